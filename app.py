@@ -1,140 +1,345 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import yfinance as yf
+import numpy as np
 import datetime
+import functools
 import io
+import csv
+import json
+import pathlib
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from types import MappingProxyType
+
+# VIXの最終取得値を保存するファイル (オフライン時のフォールバック用)
+_CACHE_PATH = pathlib.Path(".cache/vix.json")
+# 保存したVIX値をフォールバックとして使う最大の経過時間 (秒)
+_CACHE_MAX_AGE = 24 * 60 * 60
+# Yahoo Financeへの問い合わせのタイムアウト (秒)
+_FETCH_TIMEOUT = 2
+# 取得に失敗した後、再取得を控える時間 (秒)
+_FAILURE_BACKOFF = 60
+# VIXの日足を返すYahoo FinanceのチャートAPI
+_VIX_CHART_URL = "https://query1.finance.yahoo.com/v8/finance/chart/%5EVIX?range={period}&interval=1d"
+
+# パーセント → 比率の変換係数 (割り算を掛け算に置き換える)
+_HUNDREDTH = 0.01
+
+# 資産名とグラフの配色 (毎回作り直さないようモジュールで1度だけ定義)
+_ASSET_NAMES = ("オルカン", "ゴールド", "キャッシュ")
+_ASSET_LABELS = ("オルカン (株式)", "ゴールド (金)", "キャッシュ (現金)")
+_COLOR_MAP = MappingProxyType({'オルカン':'royalblue', 'ゴールド':'gold', 'キャッシュ':'lightgray'})
+
+# 許容範囲内と判定したときの表示 (許容範囲は ±5% か ±10% のどちらか)
+_WITHIN_TOLERANCE_MSG = {
+    5.0: "⚪️ 維持 (許容範囲内 ±5%)",
+    10.0: "⚪️ 維持 (許容範囲内 ±10%)",
+}
+
+# VIXの水準ごとの表示 (楽観 → 通常 → 警戒 → パニック の順)
+_VIX_REGIMES = (
+    (st.success, "✅ **楽観相場**\n\n株価が高すぎる可能性があります。高値掴みに注意してください。"),
+    (st.info, "ℹ️ **通常運転**\n\n平穏な相場です。計算通りの配分で問題ありません。"),
+    (st.warning, "⚠️ **警戒水準**\n\n少し市場が不安定です。"),
+    (st.error, "⚠️ **パニック相場**\n\n今は株が安売りされている「買い場」かもしれません。積極的な配分を検討しても良いでしょう。"),
+)
 
 # --- 関数定義エリア ---
 
-def get_market_fear():
-    """Yahoo FinanceからVIX指数を取得する"""
+def _save_cached_vix(value, fetched_at):
+    """取得したVIX値を取得時刻とともにディスクに保存する"""
     try:
-        ticker = "^VIX"
-        # 1日分のデータを取得
-        data = yf.Ticker(ticker).history(period="1d")
-        if not data.empty:
-            return data['Close'].iloc[-1]
-    except Exception:
-        return None
-    return None
+        _CACHE_PATH.parent.mkdir(exist_ok=True)
+        _CACHE_PATH.write_text(json.dumps({"ts": fetched_at, "vix": value}))
+    except OSError:
+        pass
+
+def _load_cached_vix():
+    """ディスクに保存されたVIX値を (値, 取得時刻) で返す (無いか、古すぎる場合は (None, None))"""
+    try:
+        cached = json.loads(_CACHE_PATH.read_text())
+        if time.time() - cached["ts"] > _CACHE_MAX_AGE:
+            return None, None
+        return cached["vix"], cached["ts"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, None
+
+def _vix_from_disk():
+    """ディスクの前回値を get_vix_data と同じ (現在値, 履歴なし, 取得時刻) の形で返す"""
+    value, fetched_at = _load_cached_vix()
+    return value, None, fetched_at
+
+@st.cache_resource(show_spinner=False)
+def _vix_ticker():
+    """VIXのTickerを1つだけ作り、HTTPセッションを再取得のたびに使い回す"""
+    # yfinance は依存ライブラリが多く重いので、最初の取得時まで読み込まない
+    import yfinance as yf
+    return yf.Ticker("^VIX")
+
+def _fetch_vix_chart(period):
+    """Yahoo FinanceのチャートAPIから直接VIXの日足終値 (Date, Close) を取得する"""
+    request = urllib.request.Request(
+        _VIX_CHART_URL.format(period=period), headers={"User-Agent": "Mozilla/5.0"}
+    )
+    with urllib.request.urlopen(request, timeout=_FETCH_TIMEOUT) as response:
+        result = json.load(response)["chart"]["result"][0]
+    # yfinance と同じく、取引所のタイムゾーンの日付 (0時) にそろえる
+    dates = pd.to_datetime(result["timestamp"], unit="s", utc=True)
+    dates = dates.tz_convert(result["meta"]["exchangeTimezoneName"]).normalize()
+    return pd.DataFrame({
+        "Date": dates,
+        "Close": result["indicators"]["quote"][0]["close"],
+    }).dropna()
+
+def _fetch_vix_yfinance(period):
+    """yfinance経由でVIXの日足終値 (Date, Close) を取得する (チャートAPIが使えない場合の予備)"""
+    data = _vix_ticker().history(period=period, timeout=_FETCH_TIMEOUT)
+    return data['Close'].reset_index()
+
+@st.cache_data(ttl=900, show_spinner=False)
+def _fetch_vix_data(period):
+    """Yahoo FinanceからVIX指数の (現在値, 履歴, 取得時刻) を取得する (15分間キャッシュ)
+
+    取得できなかった場合は例外を送出する。st.cache_data は例外をキャッシュしないため、
+    失敗した取得は次の再実行でやり直される。
+    """
+    for fetch in (_fetch_vix_chart, _fetch_vix_yfinance):
+        try:
+            history = fetch(period)
+        except Exception:
+            continue
+        if not history.empty:
+            current_value = float(history['Close'].iloc[-1])
+            fetched_at = time.time()
+            _save_cached_vix(current_value, fetched_at)
+            return current_value, history, fetched_at
+    raise RuntimeError("VIX指数を取得できませんでした")
+
+@st.cache_resource(show_spinner=False)
+def _vix_fetch_state():
+    """全セッションで共有する取得状態 (直近の取得失敗時刻)"""
+    return {"failed_at": 0.0}
 
 def get_vix_data(period="1y"):
-    """Yahoo FinanceからVIX指数の履歴と現在値を取得する"""
+    """Yahoo FinanceからVIX指数の (現在値, 履歴, 取得時刻) を取得する
+
+    取得に失敗した場合は、ディスクに保存した前回の値と履歴なし (None) を返す。
+    失敗後 _FAILURE_BACKOFF 秒間はネットワークに問い合わせず、すぐにディスクの値を返す。
+    """
+    state = _vix_fetch_state()
+    if time.time() - state["failed_at"] < _FAILURE_BACKOFF:
+        return _vix_from_disk()
     try:
-        ticker = "^VIX"
-        data = yf.Ticker(ticker).history(period=period)
-        if not data.empty:
-            current_value = data['Close'].iloc[-1]
-            return current_value, data.reset_index()
+        return _fetch_vix_data(period)
     except Exception:
-        return None, None
-    return None, None
+        state["failed_at"] = time.time()
+        return _vix_from_disk()
+
+def prefetch_vix(period="1y"):
+    """このセッション専用のスレッドでVIX取得を開始し、Futureを返す
+
+    前回の再実行で始めた取得がまだ終わっていなければ、新たに積まずにそれを使う。
+    """
+    future = st.session_state.get("_vix_future")
+    if future is not None and not future.done():
+        return future
+    if "_vix_executor" not in st.session_state:
+        st.session_state["_vix_executor"] = ThreadPoolExecutor(max_workers=1)
+    future = st.session_state["_vix_executor"].submit(get_vix_data, period=period)
+    st.session_state["_vix_future"] = future
+    return future
+
+@functools.lru_cache(maxsize=1)
+def _go():
+    """plotly.graph_objects を初めて使うときに読み込む (起動時のimportを省く)"""
+    import plotly.graph_objects as go_mod
+    return go_mod
+
+@st.cache_data(max_entries=16)
+def build_allocation_pies(current_values, future_values):
+    """現在と購入後の資産配分を、1つの図に2つのドーナツグラフとして並べる
+
+    グラフを1つにまとめることで、ブラウザへ送るPlotly要素が1つで済む。
+    同じ値ならキャッシュを再利用する。
+    """
+    go = _go()
+    colors = [_COLOR_MAP[name] for name in _ASSET_NAMES]
+    fig = go.Figure()
+    for values, title, x_domain in (
+        (current_values, "現在 (Before)", [0.0, 0.48]),
+        (future_values, "購入後 (After)", [0.52, 1.0]),
+    ):
+        fig.add_trace(go.Pie(
+            labels=_ASSET_NAMES,
+            values=list(values),
+            hole=0.4,
+            marker=dict(colors=colors),
+            title=dict(text=title),
+            domain=dict(x=x_domain),
+        ))
+    fig.update_layout(legend=dict(orientation="h"), margin=dict(t=20, b=20, l=0, r=0))
+    return fig
+
+@st.cache_data
+def build_vix_line(history):
+    """VIX指数の推移グラフを作成する (履歴が変わらない限りキャッシュを再利用)"""
+    go = _go()
+    fig = go.Figure(go.Scatter(x=history["Date"], y=history["Close"], mode="lines"))
+    fig.add_hline(y=30, line_dash="dash", line_color="red", annotation_text="パニック (30)")
+    fig.add_hline(y=20, line_dash="dash", line_color="orange", annotation_text="警戒 (20)")
+    fig.update_layout(title="VIX指数の推移 (過去1年)", xaxis_title="日付", yaxis_title="VIX", height=350)
+    return fig
+
+def check_tolerance(gaps, targets, total_assets):
+    """各資産の目標比率からの乖離が許容範囲内かを判定し、調整後のギャップと判定文言を返す
+
+    許容範囲は目標比率が20%以下の資産は±5%、それ以外は±10%。
+    範囲内の資産はギャップを0として扱う。
+    """
+    thresholds = np.where(targets <= 20, 5.0, 10.0)
+    is_within_tolerance = np.abs(gaps) / total_assets * 100 <= thresholds
+    adjusted_gaps = np.where(is_within_tolerance, 0.0, gaps)
+
+    statuses = [
+        _WITHIN_TOLERANCE_MSG[threshold] if within
+        else "🟢 買い (乖離大)" if gap > 0
+        else "🔴 売り (乖離大)"
+        for gap, threshold, within in zip(gaps, thresholds, is_within_tolerance)
+    ]
+    return adjusted_gaps, statuses
+
+def compute_allocation(targets, currents, additional_fund):
+    """目標比率・現在の評価額・追加資金から、各資産への配分額と判定を計算する
+
+    (配分額の配列, 判定文言のリスト) を返す。資産の並びはオルカン, ゴールド, キャッシュ。
+    """
+    targets = np.array(targets, dtype=float)
+    currents = np.array(currents, dtype=float)
+
+    # 1. リバランス後の総資産予測 (現在額 + 追加資金)
+    projected_total_assets = currents.sum() + additional_fund
+
+    # 2. リバランス後にあるべき理想の金額 (Target Amount)
+    target_ratios = targets * _HUNDREDTH
+    ideals = projected_total_assets * target_ratios
+
+    # 3. 現状とのギャップ (理想 - 現在) = 不足している金額
+    raw_gaps = ideals - currents
+
+    # 許容範囲の判定とギャップの調整 (Filtering)
+    adj_gaps, statuses = check_tolerance(raw_gaps, targets, projected_total_assets)
+
+    # 4. 配分ロジック (Allocation Logic)
+    pos_gaps = np.maximum(0, adj_gaps)
+    total_positive_gap = pos_gaps.sum()
+
+    if total_positive_gap > 0:
+        allocs = additional_fund * (pos_gaps / total_positive_gap)
+    else:
+        allocs = additional_fund * target_ratios
+        statuses = np.where(allocs > 0, "🔵 積立 (比率配分)", statuses).tolist()
+
+    return allocs, statuses
+
+# --- レポートCSV作成機能 ---
+def create_report_csv(summary_data, df_instructions, current_vix, additional_fund):
+    """資産状況サマリーと配分指示をまとめたCSVレポートを作成する"""
+    # メモリ上にテキストバッファを作成
+    output = io.StringIO()
+    
+    # 1. 基本情報
+    now_str = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    vix_str = f"{current_vix:.2f}" if current_vix else "取得失敗"
+    
+    output.write("【基本情報】\n")
+    output.write(f"ダウンロード日時,{now_str}\n")
+    output.write(f"VIX指数,{vix_str}\n")
+    output.write(f"追加資金合計,{additional_fund} 万円\n")
+    output.write("\n")
+    
+    # 2. 資産状況サマリー
+    writer = csv.writer(output, lineterminator="\n")
+    output.write("【資産運用状況】\n")
+    writer.writerow(["資産名", "評価額(万円)", "元本(万円)", "損益(万円)", "損益率"])
+    writer.writerows(summary_data)
+    output.write("\n")
+    
+    # 3. リバランス指示書
+    output.write("【リバランス配分指示】\n")
+    writer.writerow(df_instructions.columns)
+    writer.writerows(df_instructions.itertuples(index=False))
+    
+    # バッファの内容をutf-8-sigでエンコードして返す
+    return output.getvalue().encode('utf-8-sig')
 
 # --- ページ設定 ---
-st.set_page_config(page_title="Annual Portfolio Allocator", layout="wide")
+# ページ設定はセッションの最初の実行時だけ送る
+if "_page_configured" not in st.session_state:
+    st.set_page_config(page_title="Annual Portfolio Allocator", layout="wide")
+    st.session_state["_page_configured"] = True
 
 st.title("⚖️ ノーセルリバランスアプリ")
 st.markdown("今年投入する追加資金を配分します。\n\n**目標比率とのズレが許容範囲内（±5~10%）の場合は、ズレを埋めることよりも、目標比率通りの積立を優先します。**")
 
 # --- サイドバー：入力エリア ---
-st.sidebar.header("1. 目標比率の設定 (%)")
-target_orkan = st.sidebar.number_input("オルカン (株式)", value=60, step=5)
-target_gold = st.sidebar.number_input("ゴールド (金)", value=10, step=5)
-target_cash = st.sidebar.number_input("キャッシュ (現金)", value=30, step=5)
+# 入力はフォームにまとめ、「再計算」ボタンを押したときだけ再実行する
+with st.sidebar.form("inputs"):
+    st.header("1. 目標比率の設定 (%)")
+    target_orkan = st.number_input("オルカン (株式)", value=60, step=5)
+    target_gold = st.number_input("ゴールド (金)", value=10, step=5)
+    target_cash = st.number_input("キャッシュ (現金)", value=30, step=5)
 
-# 合計チェック
-total_ratio = target_orkan + target_gold + target_cash
-if total_ratio != 100:
-    st.sidebar.error(f"合計が {total_ratio}% です。100%になるように調整してください。")
-
-st.sidebar.markdown("---")
+    st.markdown("---")
 
-st.sidebar.header("2. 現在の評価額 & 元本 (万円)")
-st.sidebar.caption("損益計算のため、元本（投資額）も入力してください。")
+    st.header("2. 現在の評価額 & 元本 (万円)")
+    st.caption("損益計算のため、元本（投資額）も入力してください。")
 
-# オルカン
-current_orkan = st.sidebar.number_input("オルカン 評価額", value=650, step=10)
-principal_orkan = st.sidebar.number_input("オルカン 元本", value=500, step=10)
+    # オルカン
+    current_orkan = st.number_input("オルカン 評価額", value=650, step=10)
+    principal_orkan = st.number_input("オルカン 元本", value=500, step=10)
 
-# ゴールド
-st.sidebar.markdown("---") 
-current_gold = st.sidebar.number_input("ゴールド 評価額", value=150, step=10)
-principal_gold = st.sidebar.number_input("ゴールド 元本", value=100, step=10)
+    # ゴールド
+    st.markdown("---")
+    current_gold = st.number_input("ゴールド 評価額", value=150, step=10)
+    principal_gold = st.number_input("ゴールド 元本", value=100, step=10)
 
-# キャッシュ
-st.sidebar.markdown("---")
-current_cash = st.sidebar.number_input("現在の現金保有額", value=200, step=10)
-# キャッシュの元本は常に評価額と同じとみなす
-principal_cash = current_cash 
+    # キャッシュ
+    st.markdown("---")
+    current_cash = st.number_input("現在の現金保有額", value=200, step=10)
+    # キャッシュの元本は常に評価額と同じとみなす
+    principal_cash = current_cash
 
-st.sidebar.markdown("---")
+    st.markdown("---")
 
-st.sidebar.header("3. 追加資金 (万円)")
-st.sidebar.caption("今年一年で追加する資金（積立総額＋ボーナス＋貯金）を入力してください。")
-additional_fund = st.sidebar.number_input("今回投入する資金合計", value=100, step=10)
+    st.header("3. 追加資金 (万円)")
+    st.caption("今年一年で追加する資金（積立総額＋ボーナス＋貯金）を入力してください。")
+    additional_fund = st.number_input("今回投入する資金合計", value=100, step=10)
 
-# --- 計算ロジック ---
+    st.form_submit_button("再計算")
 
-# 1. リバランス後の総資産予測 (現在額 + 追加資金)
-projected_total_assets = current_orkan + current_gold + current_cash + additional_fund
+# 合計チェック (フォームの外で行い、送信ボタンは常に表示されるようにする)
+total_ratio = target_orkan + target_gold + target_cash
+if total_ratio != 100:
+    st.sidebar.error(f"合計が {total_ratio}% です。100%になるように調整してください。")
+    # 比率が不正な間は以降の計算・グラフ・VIX取得をすべて省略する
+    st.stop()
 
-# 2. リバランス後にあるべき理想の金額 (Target Amount)
-ideal_orkan = projected_total_assets * (target_orkan / 100)
-ideal_gold = projected_total_assets * (target_gold / 100)
-ideal_cash = projected_total_assets * (target_cash / 100)
+# VIX取得を先に開始し、計算やグラフ描画と並行してネットワーク待ちを進める
+vix_future = prefetch_vix(period="1y")
 
-# 3. 現状とのギャップ (理想 - 現在) = 不足している金額
-raw_gap_orkan = ideal_orkan - current_orkan
-raw_gap_gold = ideal_gold - current_gold
-raw_gap_cash = ideal_cash - current_cash
+# --- 計算ロジック ---
 
-# --- 許容範囲の判定とギャップの調整 (Filtering) ---
+# 資産の並びはオルカン, ゴールド, キャッシュ
+targets = (target_orkan, target_gold, target_cash)
+currents = (current_orkan, current_gold, current_cash)
 
-def check_tolerance(gap_val, target_pct, total_assets):
-    deviation_pct = (abs(gap_val) / total_assets) * 100
-    threshold = 5.0 if target_pct <= 20 else 10.0
-    is_within_tolerance = deviation_pct <= threshold
-    adjusted_gap = 0 if is_within_tolerance else gap_val
-    
-    status_text = ""
-    if is_within_tolerance:
-        status_text = f"⚪️ 維持 (許容範囲内 ±{int(threshold)}%)"
-    elif gap_val > 0:
-        status_text = "🟢 買い (乖離大)"
-    else:
-        status_text = "🔴 売り (乖離大)"
-        
-    return adjusted_gap, status_text
-
-adj_gap_orkan, status_orkan = check_tolerance(raw_gap_orkan, target_orkan, projected_total_assets)
-adj_gap_gold, status_gold = check_tolerance(raw_gap_gold, target_gold, projected_total_assets)
-adj_gap_cash, status_cash = check_tolerance(raw_gap_cash, target_cash, projected_total_assets)
-
-# 4. 配分ロジック (Allocation Logic)
-pos_gap_orkan = max(0, adj_gap_orkan)
-pos_gap_gold = max(0, adj_gap_gold)
-pos_gap_cash = max(0, adj_gap_cash)
-total_positive_gap = pos_gap_orkan + pos_gap_gold + pos_gap_cash
-
-if total_positive_gap > 0:
-    alloc_orkan = additional_fund * (pos_gap_orkan / total_positive_gap)
-    alloc_gold = additional_fund * (pos_gap_gold / total_positive_gap)
-    alloc_cash = additional_fund * (pos_gap_cash / total_positive_gap)
-else:
-    alloc_orkan = additional_fund * (target_orkan / 100)
-    alloc_gold = additional_fund * (target_gold / 100)
-    alloc_cash = additional_fund * (target_cash / 100)
-    
-    if alloc_orkan > 0: status_orkan = "🔵 積立 (比率配分)"
-    if alloc_gold > 0: status_gold = "🔵 積立 (比率配分)"
-    if alloc_cash > 0: status_cash = "🔵 積立 (比率配分)"
+allocs, statuses = compute_allocation(targets, currents, additional_fund)
+alloc_orkan, alloc_gold, alloc_cash = allocs
 
-# 5. 購入後の予想資産額
-future_orkan = current_orkan + alloc_orkan
-future_gold = current_gold + alloc_gold
-future_cash = current_cash + alloc_cash
-future_total = future_orkan + future_gold + future_cash
+# 購入後の予想資産額
+future_values = np.add(currents, allocs)
+future_total = future_values.sum()
 
 # --- 損益計算ロジック ---
 # オルカン
@@ -151,9 +356,6 @@ total_principal = principal_orkan + principal_gold + principal_cash
 total_profit = total_current - total_principal
 total_profit_rate = (total_profit / total_principal * 100) if total_principal > 0 else 0
 
-# VIX取得（ここで取得しておく）
-current_vix, history_vix = get_vix_data(period="1y")
-
 # --- メイン画面 ---
 
 col1, col2 = st.columns([1, 1.5])
@@ -161,22 +363,19 @@ col1, col2 = st.columns([1, 1.5])
 with col1:
     st.subheader("📊 アセットアロケーション")
     
+    # 現在と購入後の円グラフは1つの図にまとめて表示
+    st.plotly_chart(
+        build_allocation_pies(
+            currents,
+            tuple(future_values),
+        ),
+        use_container_width=True,
+    )
+
     tab1, tab2 = st.tabs(["現在 (Before)", "購入後 (After)"])
-    color_map = {'オルカン':'royalblue', 'ゴールド':'gold', 'キャッシュ':'lightgray'}
     
     with tab1:
-        # 1. 円グラフを先に表示
-        df_current = pd.DataFrame({
-            "Asset": ["オルカン", "ゴールド", "キャッシュ"],
-            "Value": [current_orkan, current_gold, current_cash]
-        })
-        fig_cur = px.pie(df_current, values='Value', names='Asset', hole=0.4,
-                     color='Asset', color_discrete_map=color_map)
-        st.plotly_chart(fig_cur, use_container_width=True)
-        
-        st.markdown("---")
-
-        # 2. 運用成績をグラフの下に表示
+        # 運用成績
         st.markdown("##### 運用成績")
         
         # 全体の損益
@@ -200,20 +399,10 @@ with col1:
         )
 
     with tab2:
-        df_future = pd.DataFrame({
-            "Asset": ["オルカン", "ゴールド", "キャッシュ"],
-            "Value": [future_orkan, future_gold, future_cash]
-        })
-        fig_fut = px.pie(df_future, values='Value', names='Asset', hole=0.4,
-                     color='Asset', color_discrete_map=color_map)
-        st.plotly_chart(fig_fut, use_container_width=True)
-        
         st.success(f"購入後の総資産: **{future_total:,.1f} 万円**")
         st.caption("購入後の比率 vs 目標:")
-        col_r1, col_r2, col_r3 = st.columns(3)
-        col_r1.metric("オルカン", f"{future_orkan/future_total*100:.1f}%", f"目標 {target_orkan}%")
-        col_r2.metric("ゴールド", f"{future_gold/future_total*100:.1f}%", f"目標 {target_gold}%")
-        col_r3.metric("キャッシュ", f"{future_cash/future_total*100:.1f}%", f"目標 {target_cash}%")
+        for col_r, name, value, target in zip(st.columns(3), _ASSET_NAMES, future_values, targets):
+            col_r.metric(name, f"{value/future_total*100:.1f}%", f"目標 {target}%")
 
 with col2:
     st.subheader("🛠 リバランス指示書")
@@ -224,74 +413,70 @@ with col2:
         st.write(f"追加資金 **{additional_fund:,.1f} 万円** の最適な配分は以下の通りです。")
         
         # テーブルデータの作成
-        assets_info = [
-            ("オルカン (株式)", status_orkan, alloc_orkan),
-            ("ゴールド (金)", status_gold, alloc_gold),
-            ("キャッシュ (現金)", status_cash, alloc_cash)
-        ]
-        
-        table_data = []
-        for name, status, alloc in assets_info:
-            ratio = (alloc / additional_fund * 100) if additional_fund > 0 else 0
-            amount_str = f"{alloc:,.1f} 万円"
-            ratio_str = f"{ratio:.1f} %"
-            table_data.append([name, status, amount_str, ratio_str])
-            
-        df_res = pd.DataFrame(table_data, columns=["資産クラス", "判定 (Status)", "今回配分額", "配分比率"])
-        st.table(df_res)
+        # ここは additional_fund > 0 のときだけ通るので比率は配列でまとめて計算できる
+        alloc_ratios = allocs / additional_fund * 100
+        # 金額・比率の文字列は1度だけ作り、手順とCSVレポートの両方で使い回す
+        amount_strs = [format(alloc, ",.1f") + " 万円" for alloc in allocs]
+        ratio_nums = [format(ratio, ".1f") for ratio in alloc_ratios]
+        ratio_strs = [ratio + " %" for ratio in ratio_nums]
+
+        # 表は数値のまま渡し、表示形式 (桁区切り付き) はStylerで付ける
+        amount_col, ratio_col = "今回配分額", "配分比率"
+        df_res = pd.DataFrame({
+            "資産クラス": _ASSET_LABELS,
+            "判定 (Status)": statuses,
+            amount_col: allocs,
+            ratio_col: alloc_ratios,
+        })
+        st.dataframe(
+            df_res.style.format({amount_col: "{:,.1f} 万円", ratio_col: "{:.1f} %"}),
+            hide_index=True,
+            use_container_width=True,
+        )
+        # CSVには同じ表の金額・比率を書式付きの文字列に差し替えて出力する
+        df_instructions = df_res.assign(**{amount_col: amount_strs, ratio_col: ratio_strs})
         
         # 具体的な手順
         st.markdown("### 📝 具体的な手順")
         
         if alloc_cash > 0:
-             st.write(f"- 銀行口座に **{alloc_cash:,.1f} 万円** をそのまま貯金（または国債購入）してください。")
+             st.write(f"- 銀行口座に **{amount_strs[2]}** をそのまま貯金（または国債購入）してください。")
              
         invest_total = alloc_orkan + alloc_gold
         if invest_total > 0:
             st.write(f"- 証券口座で合計 **{invest_total:,.1f} 万円** の注文を出してください。")
             if alloc_orkan > 0:
-                st.write(f"  - うち **{alloc_orkan:,.1f} 万円** ({alloc_orkan/additional_fund*100:.1f}%) でオルカンを購入")
+                st.write(f"  - うち **{amount_strs[0]}** ({ratio_nums[0]}%) でオルカンを購入")
             if alloc_gold > 0:
-                st.write(f"  - うち **{alloc_gold:,.1f} 万円** ({alloc_gold/additional_fund*100:.1f}%) でゴールドを購入")
+                st.write(f"  - うち **{amount_strs[1]}** ({ratio_nums[1]}%) でゴールドを購入")
     
     st.markdown("---")
     
-    # --- レポートCSV作成機能 ---
-    def create_report_csv(df_instructions, current_vix, additional_fund):
-        # メモリ上にテキストバッファを作成
-        output = io.StringIO()
-        
-        # 1. 基本情報
-        now_str = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        vix_str = f"{current_vix:.2f}" if current_vix else "取得失敗"
-        
-        output.write("【基本情報】\n")
-        output.write(f"ダウンロード日時,{now_str}\n")
-        output.write(f"VIX指数,{vix_str}\n")
-        output.write(f"追加資金合計,{additional_fund} 万円\n")
-        output.write("\n")
-        
-        # 2. 資産状況サマリー
-        output.write("【資産運用状況】\n")
+    # 先読みしておいたVIXの結果を受け取る (CSVレポートとVIXエリアで使う)
+    # 取得が長引いている場合は待たずにディスクの前回値を使う
+    try:
+        current_vix, history_vix, vix_fetched_at = vix_future.result(timeout=_FETCH_TIMEOUT)
+    except FutureTimeoutError:
+        current_vix, history_vix, vix_fetched_at = _vix_from_disk()
+
+    # 取得できた結果はセッションへ保存し、失敗時はディスクの値より新しければ使い回す
+    # (どちらも _CACHE_MAX_AGE より古い値は使わない)
+    if history_vix is not None:
+        st.session_state["vix_last"] = (current_vix, history_vix, vix_fetched_at)
+    elif "vix_last" in st.session_state:
+        saved_vix = st.session_state["vix_last"]
+        is_fresh = time.time() - saved_vix[2] <= _CACHE_MAX_AGE
+        if is_fresh and (vix_fetched_at is None or saved_vix[2] >= vix_fetched_at):
+            current_vix, history_vix, vix_fetched_at = saved_vix
+
+    if additional_fund > 0:
         summary_data = [
             ["オルカン", current_orkan, principal_orkan, profit_orkan, f"{profit_rate_orkan:.1f}%"],
             ["ゴールド", current_gold, principal_gold, profit_gold, f"{profit_rate_gold:.1f}%"],
             ["キャッシュ", current_cash, principal_cash, 0, "0.0%"],
             ["合計", total_current, total_principal, total_profit, f"{total_profit_rate:.1f}%"]
         ]
-        df_summary = pd.DataFrame(summary_data, columns=["資産名", "評価額(万円)", "元本(万円)", "損益(万円)", "損益率"])
-        df_summary.to_csv(output, index=False)
-        output.write("\n")
-        
-        # 3. リバランス指示書
-        output.write("【リバランス配分指示】\n")
-        df_instructions.to_csv(output, index=False)
-        
-        # バッファの内容をutf-8-sigでエンコードして返す
-        return output.getvalue().encode('utf-8-sig')
-
-    if additional_fund > 0:
-        csv_data = create_report_csv(df_res, current_vix, additional_fund)
+        csv_data = create_report_csv(summary_data, df_instructions, current_vix, additional_fund)
         
         st.download_button(
             label="📥 詳細レポートをCSVでダウンロード",
@@ -309,20 +494,12 @@ with col2:
         st.metric(label="現在のVIX指数", value=f"{current_vix:.2f}")
         
         if history_vix is not None:
-            fig_vix = px.line(history_vix, x="Date", y="Close", title="VIX指数の推移 (過去1年)")
-            fig_vix.add_hline(y=30, line_dash="dash", line_color="red", annotation_text="パニック (30)")
-            fig_vix.add_hline(y=20, line_dash="dash", line_color="orange", annotation_text="警戒 (20)")
-            fig_vix.update_layout(xaxis_title="日付", yaxis_title="VIX", height=350)
-            st.plotly_chart(fig_vix, use_container_width=True)
-
-        if current_vix > 30:
-            st.error("⚠️ **パニック相場**\n\n今は株が安売りされている「買い場」かもしれません。積極的な配分を検討しても良いでしょう。")
-        elif current_vix > 20:
-            st.warning("⚠️ **警戒水準**\n\n少し市場が不安定です。")
-        elif current_vix < 15:
-            st.success("✅ **楽観相場**\n\n株価が高すぎる可能性があります。高値掴みに注意してください。")
-        else:
-            st.info("ℹ️ **通常運転**\n\n平穏な相場です。計算通りの配分で問題ありません。")
+            st.plotly_chart(build_vix_line(history_vix), use_container_width=True)
+
+        # 15未満 / 15以上20以下 / 20超30以下 / 30超 の4区分 (比較結果の合計が区分番号になる)
+        regime = (current_vix >= 15) + (current_vix > 20) + (current_vix > 30)
+        show_regime, regime_msg = _VIX_REGIMES[regime]
+        show_regime(regime_msg)
             
     else:
         st.caption("※VIX指数の取得に失敗しました")